@@ -4,8 +4,9 @@ SRT 字幕翻译工具（自动检测源语言 -> 简体中文）
 功能：
 ├─ 解析 SRT 字幕文件
 ├─ 分批调用 DeepSeek API 翻译（自动检测源语言 -> 中文）
-├─ 支持断点续翻（已翻译部分自动跳过）
-├─ 多线程并发请求
+├─ 支持断点续翻（已翻译部分自动跳过；每批写完即 fsync，可随时中断后重跑）
+├─ 缓存 API 响应（重跑时命中缓存的批次不再请求）
+├─ 多线程并发请求（AIMD 自适应并发数）
 └─ 输出双语 SRT（中文在上，原文在下）
 
 输入：
@@ -14,22 +15,37 @@ SRT 字幕翻译工具（自动检测源语言 -> 简体中文）
 
 输出：
   数据文件路径：data/subs/{原文件名}.zh-llm.srt
+  缓存文件路径：data/cache/deepseek/
 """
 
 from __future__ import annotations
 
+import hashlib
+import http.client
 import json
+import os
+import queue
+import random
 import re
+import socket
+import threading
 import time
-import urllib.request
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import urllib.parse
+from concurrent.futures import CancelledError, ThreadPoolExecutor, as_completed
 from dataclasses import dataclass
+from functools import lru_cache
 from pathlib import Path
 
+try:
+    import orjson
+except ImportError:  # orjson 可选；未安装时退回标准库 json
+    orjson = None
+
 
 # ======= Path =======
 CFG_YAML = Path("config/deepseek.yaml")
 OUT_DIR = Path("data/subs")
+CACHE_DIR = Path("data/cache/deepseek")
 
 
 # ======= SRT =======
@@ -45,45 +61,71 @@ def read_text(path: Path) -> str:
 
 
 def parse_srt(s: str) -> list[SrtBlock]:
-    lines = s.splitlines()
-    i = 0
-    blocks: list[SrtBlock] = []
-
-    while i < len(lines):
-        if not lines[i].strip():
-            i += 1
-            continue
+    # Windows 生成的字幕常带 UTF-8 BOM
+    if s.startswith("\ufeff"):
+        s = s[1:]
 
-        idx = int(lines[i].strip())
-        i += 1
-        t = lines[i].strip()
-        i += 1
-
-        txt: list[str] = []
-        while i < len(lines) and lines[i].strip():
-            txt.append(lines[i].rstrip("\n"))
-            i += 1
+    blocks: list[SrtBlock] = []
+    append = blocks.append
+    SB = SrtBlock
+
+    # 0=等待序号 1=等待时间轴 2=正文；格式不符时直接报错，不静默丢条目
+    state = 0
+    idx = 0
+    t = ""
+    txt: list[str] = []
+
+    for n, raw in enumerate(s.splitlines(), 1):
+        stripped = raw.strip()
+        if state == 0:
+            if stripped:
+                if not stripped.isdigit():
+                    raise ValueError(f"SRT 第 {n} 行应为字幕序号: {raw!r}")
+                idx = int(stripped)
+                state = 1
+        elif state == 1:
+            t = stripped
+            txt = []
+            state = 2
+        elif stripped:
+            txt.append(raw)
+        else:
+            append(SB(idx=idx, time=t, lines=txt))
+            state = 0
 
-        blocks.append(SrtBlock(idx=idx, time=t, lines=txt))
-        while i < len(lines) and not lines[i].strip():
-            i += 1
+    if state == 2:
+        append(SB(idx=idx, time=t, lines=txt))
 
     return blocks
 
 
 def write_bi_srt_line(f, b: SrtBlock, zh_lines: list[str]) -> None:
-    f.write(f"{b.idx}\n")
-    f.write(f"{b.time}\n")
-    if zh_lines:
-        for line in zh_lines:
-            f.write(f"{line}\n")
-    if b.lines:
-        for line in b.lines:
-            f.write(f"{line}\n")
-    f.write("\n")
+    parts = [str(b.idx), b.time]
+    parts.extend(zh_lines)
+    parts.extend(b.lines)
+    parts.append("\n")
+    f.write("\n".join(parts))
 
 
 # ======= Config (KV-YAML) =======
+QSTR_RE = re.compile(r"""^(["']).*\1$""")
+BOOL_RE = re.compile(r"^(?:true|false)$", re.I)
+INT_RE = re.compile(r"^[+-]?\d+$")
+FLOAT_RE = re.compile(r"^[+-]?(?:\d+\.\d*|\.\d+|\d+)(?:[eE][+-]?\d+)?$")
+
+
+def parse_yaml_val(val: str) -> object:
+    if QSTR_RE.match(val):
+        return val[1:-1]
+    if BOOL_RE.match(val):
+        return val.lower() == "true"
+    if INT_RE.match(val):
+        return int(val)
+    if FLOAT_RE.match(val):
+        return float(val)
+    return val
+
+
 def load_yaml_kv(path: Path) -> dict[str, object]:
     out: dict[str, object] = {}
     for raw in path.read_text(encoding="utf-8").splitlines():
@@ -92,40 +134,50 @@ def load_yaml_kv(path: Path) -> dict[str, object]:
             continue
 
         k, v = raw.split(":", 1)
-        key = k.strip()
-        val = v.strip()
+        out[k.strip()] = parse_yaml_val(v.strip())
 
-        if (val.startswith('"') and val.endswith('"')) or (val.startswith("'") and val.endswith("'")):
-            out[key] = val[1:-1]
-            continue
+    return out
 
-        if val.lower() == "true":
-            out[key] = True
-            continue
-        if val.lower() == "false":
-            out[key] = False
-            continue
 
-        try:
-            out[key] = int(val)
-            continue
-        except ValueError:
-            pass
+# ======= DeepSeek API =======
+API_URL = "https://api.deepseek.com/chat/completions"
+API_HOST = urllib.parse.urlsplit(API_URL).netloc
+API_PATH = urllib.parse.urlsplit(API_URL).path
+MARK_RE = re.compile(r"<<<SRT:(\d{6})>>>")
 
-        try:
-            out[key] = float(val)
-            continue
-        except ValueError:
-            pass
+SYS_ONE = (
+    "你是字幕翻译器。自动检测输入字幕的语言，将其翻译成简体中文。\n"
+    "如果输入已经是中文，则原样输出。\n"
+    "只输出中文译文，不要输出原文，不要输出解释，不要使用 Markdown 代码块。\n"
+)
+SYS_BATCH = (
+    "你是字幕翻译器。自动检测输入字幕的语言，将其翻译成简体中文。\n"
+    "如果输入已经是中文，则原样输出。\n"
+    "输入会包含若干标记行，形如 <<<SRT:000001>>>。\n"
+    "输出必须严格遵守：\n"
+    "1) 必须原样输出每个标记行（不要翻译/改动标记）。\n"
+    "2) 每个标记行后，紧跟该条字幕的中文翻译（可多行）。\n"
+    "3) 不要输出任何原文，不要输出解释，不要使用 Markdown 代码块。\n"
+)
+# 所有请求共用的 system 消息（只读，不会被修改）
+SYS_ONE_MSG = {"role": "system", "content": SYS_ONE}
+SYS_BATCH_MSG = {"role": "system", "content": SYS_BATCH}
 
-        out[key] = val
 
-    return out
+# 标记串按批内序号缓存，重试和补译时重复构建批次文本不再重复格式化
+MARKS: dict[int, str] = {}
 
 
-# ======= DeepSeek API =======
-API_URL = "https://api.deepseek.com/chat/completions"
-MARK_RE = re.compile(r"<<<SRT:(\d{6})>>>")
+def json_dumps(obj: object) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj).encode("utf-8")
+
+
+def json_loads(data: bytes) -> object:
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
 
 
 def mk_mark(idx: int) -> str:
@@ -133,34 +185,47 @@ def mk_mark(idx: int) -> str:
 
 
 def mk_batch_text(blocks: list[SrtBlock]) -> str:
-    out: list[str] = []
-    for b in blocks:
-        out.append(mk_mark(b.idx))
+    # 标记用批内序号（1..n）而不是字幕序号：字幕序号可能重复（如合并文件从 1 重新编号）
+    marks = MARKS
+    parts: list[str] = []
+    app = parts.append
+    ext = parts.extend
+    for j, b in enumerate(blocks, 1):
+        m = marks.get(j)
+        if m is None:
+            m = marks[j] = mk_mark(j)
+        app(m)
         if b.lines:
-            out.extend(b.lines)
+            ext(b.lines)
         else:
-            out.append("")
-    return "\n".join(out) + "\n"
+            app("")
+    app("")
+    return "\n".join(parts)
+
+
+def est_tokens(s: str) -> int:
+    # 粗估 token 数：ASCII 约 0.27 token/字符，CJK 等其他字符约 0.9 token/字符；+8 为标记行开销
+    n_ascii = len(s.encode("ascii", "ignore"))
+    return int(0.27 * n_ascii + 0.9 * (len(s) - n_ascii)) + 8
 
 
-def split_batches(blocks: list[SrtBlock], max_blocks: int, max_chars: int) -> list[list[SrtBlock]]:
+def split_batches(blocks: list[SrtBlock], max_blocks: int, max_tokens: int) -> list[list[SrtBlock]]:
     batches: list[list[SrtBlock]] = []
     cur: list[SrtBlock] = []
-    cur_chars = 0
+    cur_tokens = 0
 
     for b in blocks:
-        s = "\n".join(b.lines)
-        add_chars = len(s) + 32
+        add_tokens = est_tokens("\n".join(b.lines))
         hit_blocks = cur and len(cur) >= max_blocks
-        hit_chars = cur and (cur_chars + add_chars) > max_chars
+        hit_tokens = cur and (cur_tokens + add_tokens) > max_tokens
 
-        if hit_blocks or hit_chars:
+        if hit_blocks or hit_tokens:
             batches.append(cur)
             cur = []
-            cur_chars = 0
+            cur_tokens = 0
 
         cur.append(b)
-        cur_chars += add_chars
+        cur_tokens += add_tokens
 
     if cur:
         batches.append(cur)
@@ -168,18 +233,321 @@ def split_batches(blocks: list[SrtBlock], max_blocks: int, max_chars: int) -> li
     return batches
 
 
-def post_chat(api_key: str, payload: dict, timeout_s: int) -> dict:
-    req = urllib.request.Request(
-        url=API_URL,
-        data=json.dumps(payload).encode("utf-8"),
-        headers={
-            "Authorization": f"Bearer {api_key}",
-            "Content-Type": "application/json",
-        },
-        method="POST",
+RETRY_STATUS = {408, 429, 500, 502, 503, 504}
+RETRY_CAP_S = 60.0
+
+
+class ApiError(Exception):
+    def __init__(self, status: int, reason: str, body: str, retry_after: float | None = None) -> None:
+        super().__init__(f"HTTP {status} {reason}: {body[:200]}")
+        self.status = status
+        self.retry_after = retry_after
+
+
+def parse_retry_after(v: str | None) -> float | None:
+    if not v:
+        return None
+    try:
+        return max(0.0, float(v))
+    except ValueError:
+        return None
+
+
+# 置位后不再发起新请求，退避/限速等待也立即结束（Ctrl+C 等中断时由 main 设置）
+STOP = threading.Event()
+
+
+# 全局共享的空闲 HTTPS 长连接池（LIFO）：每次请求借出一条，用完归还，避免重复 TCP+TLS 握手
+CONN_POOL: list[http.client.HTTPSConnection] = []
+CONN_BUSY: set[http.client.HTTPSConnection] = set()
+CONN_LOCK = threading.Lock()
+
+
+def open_conn(timeout_s: int) -> http.client.HTTPSConnection:
+    conn = http.client.HTTPSConnection(API_HOST, timeout=timeout_s)
+    with CONN_LOCK:
+        CONN_BUSY.add(conn)
+    return conn
+
+
+def checkout_conn(timeout_s: int) -> tuple[http.client.HTTPSConnection, bool]:
+    # 返回 (连接, 是否为复用的空闲连接)
+    with CONN_LOCK:
+        conn = CONN_POOL.pop() if CONN_POOL else None
+        if conn is not None:
+            CONN_BUSY.add(conn)
+    if conn is None:
+        return open_conn(timeout_s), False
+    conn.timeout = timeout_s
+    return conn, True
+
+
+def checkin_conn(conn: http.client.HTTPSConnection, keep: bool) -> None:
+    with CONN_LOCK:
+        CONN_BUSY.discard(conn)
+        if keep:
+            CONN_POOL.append(conn)
+    if not keep:
+        conn.close()
+
+
+def close_conns() -> None:
+    with CONN_LOCK:
+        conns = CONN_POOL[:]
+        CONN_POOL.clear()
+    for conn in conns:
+        conn.close()
+
+
+def connect_unless_stopped(conn: http.client.HTTPSConnection) -> None:
+    # 先建连再在 CONN_LOCK 下检查 STOP：要么在这里放弃，要么 socket 已可被 abort_conns 看到
+    if conn.sock is None:
+        conn.connect()
+    with CONN_LOCK:
+        if STOP.is_set():
+            raise CancelledError()
+
+
+def abort_conns() -> None:
+    # 中断时直接 shutdown 进行中请求的 socket，让阻塞在读响应上的线程立刻出错返回
+    with CONN_LOCK:
+        socks = [conn.sock for conn in CONN_BUSY if conn.sock is not None]
+    for sock in socks:
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+
+def read_sse_content(resp: http.client.HTTPResponse) -> str:
+    # 逐行解析 SSE：拼接 delta.content；空行与 ": keep-alive" 注释行直接跳过
+    parts: list[str] = []
+    done = False
+    for raw in resp:
+        line = raw.strip()
+        if not line or line.startswith(b":") or not line.startswith(b"data:"):
+            continue
+        data = line[5:].strip()
+        if data == b"[DONE]":
+            done = True
+            break
+        choices = json_loads(data).get("choices")
+        if choices:
+            delta = choices[0].get("delta", {}).get("content")
+            if delta:
+                parts.append(delta)
+    # 读完剩余响应体，连接才能复用
+    resp.read()
+    content = "".join(parts)
+    if not done:
+        # 没收到 [DONE]：生成中途断流或响应不是 SSE。按可重试错误处理，也不会写入缓存
+        raise http.client.IncompleteRead(content.encode("utf-8"))
+    return content
+
+
+def post_chat(api_key: str, payload: dict, timeout_s: int) -> str:
+    body = json_dumps(payload)
+    headers = {
+        "Authorization": f"Bearer {api_key}",
+        "Content-Type": "application/json",
+        "Accept": "text/event-stream",
+    }
+    conn, reused = checkout_conn(timeout_s)
+    content = ""
+    data = b""
+    try:
+        try:
+            connect_unless_stopped(conn)
+            conn.request("POST", API_PATH, body=body, headers=headers)
+            resp = conn.getresponse()
+        except ConnectionError:
+            if not reused or STOP.is_set():
+                raise
+            # 复用的空闲连接已被服务端关闭（尚未收到任何响应）：换新连接立即重发一次，
+            # 不计入退避与 AIMD；新连接再失败才按正常失败处理
+            checkin_conn(conn, keep=False)
+            conn = open_conn(timeout_s)
+            connect_unless_stopped(conn)
+            conn.request("POST", API_PATH, body=body, headers=headers)
+            resp = conn.getresponse()
+        if resp.status < 400:
+            content = read_sse_content(resp)
+        else:
+            data = resp.read()
+    except BaseException:
+        checkin_conn(conn, keep=False)
+        raise
+    checkin_conn(conn, keep=not resp.will_close)
+    if resp.status >= 400:
+        raise ApiError(
+            resp.status,
+            resp.reason,
+            data.decode("utf-8", "replace"),
+            retry_after=parse_retry_after(resp.getheader("Retry-After")),
+        )
+    return content
+
+
+class AimdLimiter:
+    """AIMD 自适应并发：每轮成功加 1 个许可，超时/429/5xx 时许可减半。"""
+
+    def __init__(self, init: int = 1, max_permits: int = 1) -> None:
+        self.cond = threading.Condition()
+        self.inflight = 0
+        # 每次减半后 epoch 加 1；在上次减半之前发出的请求失败不再重复减半
+        self.epoch = 0
+        self.configure(init, max_permits)
+
+    def configure(self, init: int, max_permits: int) -> None:
+        with self.cond:
+            self.max_permits = max(1, max_permits)
+            self.limit = float(min(max(1, init), self.max_permits))
+            self.cond.notify_all()
+
+    def acquire(self) -> int:
+        with self.cond:
+            while self.inflight >= int(self.limit):
+                self.cond.wait()
+            self.inflight += 1
+            return self.epoch
+
+    def release(self, epoch: int, outcome: str) -> None:
+        # outcome: "ok" 成功；"congested" 超时/连接错误/429/5xx；其余失败为 "neutral"，只归还许可
+        with self.cond:
+            self.inflight -= 1
+            if outcome == "ok":
+                # 每 limit 次成功约增加 1 个许可（加性增）
+                self.limit = min(float(self.max_permits), self.limit + 1.0 / self.limit)
+            elif outcome == "congested" and epoch == self.epoch:
+                self.limit = max(1.0, self.limit / 2)
+                self.epoch += 1
+            self.cond.notify_all()
+
+
+class TokenBucket:
+    """令牌桶：容量 capacity，fill_time_s 秒内从空补满；限制请求发起速率。"""
+
+    def __init__(self, capacity: int = 1, fill_time_s: float = 0.0) -> None:
+        self.lock = threading.Lock()
+        self.configure(capacity, fill_time_s)
+
+    def configure(self, capacity: int, fill_time_s: float) -> None:
+        with self.lock:
+            self.capacity = float(max(1, capacity))
+            self.rate = self.capacity / fill_time_s if fill_time_s > 0 else 0.0
+            self.tokens = self.capacity
+            self.stamp = time.monotonic()
+
+    def acquire(self, stop: threading.Event) -> bool:
+        # 拿到令牌返回 True；等待期间 stop 被置位则放弃并返回 False
+        while True:
+            with self.lock:
+                if self.rate <= 0:
+                    return True
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.stamp) * self.rate)
+                self.stamp = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return True
+                wait = (1 - self.tokens) / self.rate
+            if stop.wait(wait):
+                return False
+
+
+LIMITER = AimdLimiter()
+BUCKET = TokenBucket()
+
+
+def post_chat_retry(api_key: str, payload: dict, timeout_s: int, max_retries: int = 5, base: float = 1.0) -> str:
+    # 超时、连接错误、429/5xx 按指数退避 + 抖动重试；有 Retry-After 时取较大值
+    attempt = 0
+    while True:
+        epoch = LIMITER.acquire()
+        # 400/401 等不可重试错误、取消、解析失败都与拥塞无关，不应减半并发
+        outcome = "neutral"
+        try:
+            if STOP.is_set() or not BUCKET.acquire(STOP) or STOP.is_set():
+                raise CancelledError()
+            content = post_chat(api_key, payload, timeout_s)
+            outcome = "ok"
+            return content
+        except ApiError as e:
+            if e.status in RETRY_STATUS:
+                outcome = "congested"
+            if e.status not in RETRY_STATUS or attempt >= max_retries:
+                raise
+            wait = e.retry_after
+        except (http.client.HTTPException, OSError):
+            # 中断时 abort_conns 主动断开的连接不算拥塞
+            if not STOP.is_set():
+                outcome = "congested"
+            if attempt >= max_retries:
+                raise
+            wait = None
+        finally:
+            LIMITER.release(epoch, outcome)
+
+        sleep_s = min(RETRY_CAP_S, base * 2**attempt) + random.uniform(0, base)
+        if wait is not None and wait > sleep_s:
+            sleep_s = wait
+        STOP.wait(sleep_s)
+        attempt += 1
+
+
+def cache_key(cfg: dict[str, object], sys_msg: dict[str, str], user: str) -> str:
+    raw = f"{cfg['model']}|{cfg['temperature']}|{sys_msg['content']}|{user}"
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+def cache_path(key: str) -> Path:
+    return CACHE_DIR / key[:2] / key
+
+
+def cache_get(key: str) -> str | None:
+    p = cache_path(key)
+    if not p.exists():
+        return None
+    return p.read_text(encoding="utf-8")
+
+
+def cache_put(key: str, content: str) -> None:
+    # 先写临时文件再 rename，保证缓存文件要么完整要么不存在
+    p = cache_path(key)
+    p.parent.mkdir(parents=True, exist_ok=True)
+    tmp = p.with_name(f"{key}.{os.getpid()}.{threading.get_ident()}.tmp")
+    tmp.write_text(content, encoding="utf-8")
+    os.replace(tmp, p)
+
+
+def chat_content(cfg: dict[str, object], sys_msg: dict[str, str], user: str) -> str:
+    key = cache_key(cfg, sys_msg, user)
+    content = cache_get(key)
+    if content is not None:
+        return content
+
+    payload = {
+        "model": cfg["model"],
+        "temperature": cfg["temperature"],
+        "messages": [
+            sys_msg,
+            {"role": "user", "content": user},
+        ],
+        "stream": True,
+    }
+    content = post_chat_retry(
+        api_key=str(cfg["api_key"]),
+        payload=payload,
+        timeout_s=int(cfg["timeout_s"]),
+        max_retries=int(cfg["max_retries"]),
     )
-    with urllib.request.urlopen(req, timeout=timeout_s) as resp:
-        return json.loads(resp.read().decode("utf-8"))
+    cache_put(key, content)
+    return content
+
+
+@lru_cache(maxsize=256)
+def bar_cells(fill: int, width: int) -> str:
+    return ("▓" * fill) + ("░" * (width - fill))
 
 
 def fmt_bar(done: int, total: int, width: int) -> str:
@@ -194,17 +562,33 @@ def fmt_bar(done: int, total: int, width: int) -> str:
 
     ratio = d / total
     fill = int(ratio * width)
-    bar = ("▓" * fill) + ("░" * (width - fill))
     pct = int(ratio * 100)
-    return f"{bar} {pct:3d}% {d}/{total}"
+    return f"{bar_cells(fill, width)} {pct:3d}% {d}/{total}"
+
+
+# 进度条最多每 BAR_INTERVAL_S 秒重绘一次，且 fill/百分比没变化时不重绘
+BAR_INTERVAL_S = 0.05
+LAST_BAR = [0.0, -1, -1]  # 上次重绘的时间、fill、百分比
 
 
 def show_bar(done: int, total: int, width: int) -> None:
-    s = fmt_bar(done, total, width)
-    if not s:
+    if total <= 0:
         return
-    print(f"\r翻译进度 {s}", end="", flush=True)
-    if done >= total:
+
+    finished = done >= total
+    now = time.monotonic()
+    if not finished:
+        if now - LAST_BAR[0] < BAR_INTERVAL_S:
+            return
+        ratio = max(done, 0) / total
+        fill = int(ratio * width)
+        pct = int(ratio * 100)
+        if fill == LAST_BAR[1] and pct == LAST_BAR[2]:
+            return
+        LAST_BAR[:] = [now, fill, pct]
+
+    print(f"\r翻译进度 {fmt_bar(done, total, width)}", end="", flush=True)
+    if finished:
         print("", flush=True)
 
 
@@ -212,102 +596,137 @@ def translate_one(cfg: dict[str, object], src_lines: list[str]) -> list[str]:
     if not src_lines:
         return []
 
-    sys = (
-        "你是字幕翻译器。自动检测输入字幕的语言，将其翻译成简体中文。\n"
-        "如果输入已经是中文，则原样输出。\n"
-        "只输出中文译文，不要输出原文，不要输出解释，不要使用 Markdown 代码块。\n"
-    )
-    payload = {
-        "model": cfg["model"],
-        "temperature": cfg["temperature"],
-        "messages": [
-            {"role": "system", "content": sys},
-            {"role": "user", "content": "\n".join(src_lines)},
-        ],
-        "stream": False,
-    }
-    res = post_chat(
-        api_key=str(cfg["api_key"]),
-        payload=payload,
-        timeout_s=int(cfg["timeout_s"]),
-    )
-    content = res["choices"][0]["message"]["content"]
+    content = chat_content(cfg, SYS_ONE_MSG, "\n".join(src_lines))
     lines = [x.rstrip() for x in content.splitlines() if x.strip() and not x.strip().startswith("```")]
     return lines
 
 
 def parse_zh_map(content: str) -> dict[int, list[str]]:
-    cleaned = "\n".join([x for x in content.splitlines() if not x.strip().startswith("```")])
-    marks = list(MARK_RE.finditer(cleaned))
+    # 直接在原始输出上定位标记，分段时再跳过代码块围栏行，不再拼接一份清洗后的副本
+    marks = list(MARK_RE.finditer(content))
+    n = len(marks)
 
     out: dict[int, list[str]] = {}
     for i, m in enumerate(marks):
-        idx = int(m.group(1))
-        seg_start = m.end()
-        seg_end = marks[i + 1].start() if i + 1 < len(marks) else len(cleaned)
-        seg = cleaned[seg_start:seg_end].strip()
-        lines = [x.rstrip() for x in seg.splitlines() if x.strip()]
-        out[idx] = lines
+        seg_end = marks[i + 1].start() if i + 1 < n else len(content)
+        seg = content[m.end() : seg_end]
+        lines = [x.rstrip() for x in seg.splitlines() if x.strip() and not x.lstrip().startswith("```")]
+        if lines:
+            lines[0] = lines[0].lstrip()
+        out[int(m.group(1))] = lines
 
     return out
 
 
-def translate_batch(cfg: dict[str, object], blocks: list[SrtBlock]) -> dict[int, list[str]]:
-    sys = (
-        "你是字幕翻译器。自动检测输入字幕的语言，将其翻译成简体中文。\n"
-        "如果输入已经是中文，则原样输出。\n"
-        "输入会包含若干标记行，形如 <<<SRT:000001>>>。\n"
-        "输出必须严格遵守：\n"
-        "1) 必须原样输出每个标记行（不要翻译/改动标记）。\n"
-        "2) 每个标记行后，紧跟该条字幕的中文翻译（可多行）。\n"
-        "3) 不要输出任何原文，不要输出解释，不要使用 Markdown 代码块。\n"
-    )
+# 所有批次共用的补译线程池。与 main 中的批次线程池分开：批次线程在等待补译结果，
+# 若把补译提交回批次线程池，池满时会互相等待而死锁。实际并发仍受 LIMITER/BUCKET 约束
+FALLBACK_WORKERS = 16
+FALLBACK_EX = ThreadPoolExecutor(max_workers=FALLBACK_WORKERS, thread_name_prefix="fallback")
 
-    payload = {
-        "model": cfg["model"],
-        "temperature": cfg["temperature"],
-        "messages": [
-            {"role": "system", "content": sys},
-            {"role": "user", "content": mk_batch_text(blocks)},
-        ],
-        "stream": False,
-    }
 
-    res = post_chat(
-        api_key=str(cfg["api_key"]),
-        payload=payload,
-        timeout_s=int(cfg["timeout_s"]),
-    )
-    content = res["choices"][0]["message"]["content"]
+def translate_batch(cfg: dict[str, object], blocks: list[SrtBlock]) -> list[list[str]]:
+    # 返回与 blocks 一一对应的译文
+    content = chat_content(cfg, SYS_BATCH_MSG, mk_batch_text(blocks))
     zh_map = parse_zh_map(content)
+    zh: list[list[str] | None] = [zh_map.get(j) for j in range(1, len(blocks) + 1)]
 
-    need = {b.idx for b in blocks}
-    got = set(zh_map.keys())
-    missing = sorted(need - got)
+    # 模型漏掉的条目逐条补译，交给共享的 FALLBACK_EX 并发发出
+    missing = [j for j, lines in enumerate(zh) if lines is None]
     if missing:
-        for b in blocks:
-            if b.idx in missing:
-                zh_map[b.idx] = translate_one(cfg, b.lines)
+        futs = {FALLBACK_EX.submit(translate_one, cfg, blocks[j].lines): j for j in missing}
+        for fut in as_completed(futs):
+            zh[futs[fut]] = fut.result()
 
-    return zh_map
+    return zh
 
 
 # ======= Main =======
-def last_idx_in_srt(path: Path) -> int:
-    lines = path.read_text(encoding="utf-8").splitlines()
-    last = 0
-    for i, l in enumerate(lines[:-1]):
-        if l.strip().isdigit() and "-->" in lines[i + 1]:
-            last = int(l.strip())
-    return last
+def trim_torn_tail(path: Path) -> None:
+    # 进程在写某批中途被杀时，末尾可能残留半条字幕：截断到最后一个以空行结束的条目，
+    # 保证续写前文件为空或以 "\n\n" 结尾，不会把新条目接在残行后面
+    size = path.stat().st_size
+    with path.open("r+b") as f:
+        keep = 0
+        end = size
+        while end > 0:
+            start = max(0, end - (1 << 16))
+            f.seek(start)
+            # 多读一个字节，跨块边界的 "\n\n" 也能找到
+            pos = f.read(end - start + 1).rfind(b"\n\n")
+            if pos >= 0:
+                keep = start + pos + 2
+                break
+            end = start
+        if keep < size:
+            f.truncate(keep)
+            os.fsync(f.fileno())
+
+
+def written_cues_in_srt(path: Path) -> list[tuple[int, str]]:
+    # 批次按完成先后写入：逐行流式扫描，按文件顺序收集已写条目的 (序号, 时间轴)
+    out: list[tuple[int, str]] = []
+    prev = ""
+    with path.open("r", encoding="utf-8") as f:
+        for line in f:
+            if "-->" in line:
+                p = prev.strip()
+                if p.isdigit():
+                    out.append((int(p), line.strip()))
+            prev = line
+    return out
+
+
+def match_positions(blocks: list[SrtBlock], keys: list[tuple[int, str]]) -> list[int | None]:
+    # 把 (序号, 时间轴) 对回源文件中的位置。序号可能重复（如合并的字幕从 1 重新编号），
+    # 同一个键出现多次时按先后顺序依次对应；对不上的返回 None
+    slots: dict[tuple[int, str], list[int]] = {}
+    for pos in range(len(blocks) - 1, -1, -1):
+        b = blocks[pos]
+        slots.setdefault((b.idx, b.time), []).append(pos)
+
+    out: list[int | None] = []
+    for key in keys:
+        stack = slots.get(key)
+        out.append(stack.pop() if stack else None)
+    return out
+
 
+def sort_srt(path: Path, src: list[SrtBlock]) -> None:
+    # 全部写完后按源文件中的位置重排一次（不按序号，序号未必单调）；已经有序则不改动文件
+    blocks = parse_srt(read_text(path))
+    n = len(src)
+    order = [n if p is None else p for p in match_positions(src, [(b.idx, b.time) for b in blocks])]
+    if all(a <= b for a, b in zip(order, order[1:])):
+        return
+
+    ranked = sorted(range(len(blocks)), key=order.__getitem__)
+    tmp = path.with_name(path.name + ".tmp")
+    with tmp.open("w", encoding="utf-8", newline="\n") as f:
+        for i in ranked:
+            write_bi_srt_line(f, blocks[i], [])
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def write_worker(f, batches: list[list[SrtBlock]], wq: queue.Queue, errors: list[BaseException]) -> None:
+    # 独立写线程：独占输出文件，主线程只负责收集 API 结果
+    while True:
+        item = wq.get()
+        if item is None:
+            return
+        if errors:
+            continue
 
-def run_batch(cfg: dict[str, object], batch: list[SrtBlock]) -> dict[int, list[str]]:
-    zh_map = translate_batch(cfg, batch)
-    pause_s = float(cfg["pause_s"])
-    if pause_s > 0:
-        time.sleep(pause_s)
-    return zh_map
+        i, zh = item
+        try:
+            for b, zh_lines in zip(batches[i], zh):
+                write_bi_srt_line(f, b, zh_lines)
+            # 每批写完即落盘：进程随时被中断，已完成的批次都不会丢失
+            f.flush()
+            os.fsync(f.fileno())
+        except BaseException as e:
+            errors.append(e)
 
 
 def main() -> None:
@@ -317,40 +736,64 @@ def main() -> None:
 
     blocks = parse_srt(read_text(in_srt))
     total = len(blocks)
-    done = last_idx_in_srt(out_srt) if out_srt.exists() else 0
-    todo = [b for b in blocks if b.idx > done]
+    written: list[tuple[int, str]] = []
+    if out_srt.exists():
+        trim_torn_tail(out_srt)
+        written = written_cues_in_srt(out_srt)
+    written_pos = set(match_positions(blocks, written))
+    todo = [b for pos, b in enumerate(blocks) if pos not in written_pos]
+    done = total - len(todo)
     if not todo:
+        sort_srt(out_srt, blocks)
         show_bar(total, total, int(cfg["progress_len"]))
         print("[done] 输出已完整存在", flush=True)
         return
 
-    batches = split_batches(todo, int(cfg["max_blocks"]), int(cfg["max_chars"]))
+    batches = split_batches(todo, int(cfg["max_blocks"]), int(cfg["max_tokens"]))
     max_workers = int(cfg["max_workers"])
+    LIMITER.configure(int(cfg["init_workers"]), max_workers)
+    BUCKET.configure(int(cfg["rate_capacity"]), float(cfg["rate_fill_s"]))
     bar_len = int(cfg["progress_len"])
 
     out_srt.parent.mkdir(parents=True, exist_ok=True)
-    mode = "a" if done else "w"
-    with out_srt.open(mode, encoding="utf-8", newline="\n") as f:
+    mode = "a" if written else "w"
+    with out_srt.open(mode, encoding="utf-8", newline="\n", buffering=1 << 16) as f:
         show_bar(done, total, bar_len)
-
-        pending: dict[int, dict[int, list[str]]] = {}
-        next_write = 0
         cur_done = done
 
-        with ThreadPoolExecutor(max_workers=max_workers) as ex:
-            fut2i = {ex.submit(run_batch, cfg, batch): i for i, batch in enumerate(batches)}
-
-            for fut in as_completed(fut2i):
-                i = fut2i[fut]
-                pending[i] = fut.result()
-                cur_done += len(batches[i])
-                show_bar(cur_done, total, bar_len)
+        wq: queue.Queue = queue.Queue(maxsize=2 * max_workers)
+        errors: list[BaseException] = []
+        writer = threading.Thread(target=write_worker, args=(f, batches, wq, errors), daemon=True)
+        writer.start()
 
-                while next_write in pending:
-                    zh_map = pending.pop(next_write)
-                    for b in batches[next_write]:
-                        write_bi_srt_line(f, b, zh_map[b.idx])
-                    next_write += 1
+        try:
+            with ThreadPoolExecutor(max_workers=max_workers) as ex:
+                fut2i = {ex.submit(translate_batch, cfg, batch): i for i, batch in enumerate(batches)}
+
+                try:
+                    # 哪批先完成就先交给写线程，不等前面的慢批次
+                    for fut in as_completed(fut2i):
+                        i = fut2i[fut]
+                        wq.put((i, fut.result()))
+                        cur_done += len(batches[i])
+                        show_bar(cur_done, total, bar_len)
+                except BaseException:
+                    # Ctrl+C 或某批失败：取消排队中的批次和补译，中断进行中的请求，
+                    # 否则退出 with 时会等所有剩余批次跑完
+                    STOP.set()
+                    ex.shutdown(wait=False, cancel_futures=True)
+                    FALLBACK_EX.shutdown(wait=False, cancel_futures=True)
+                    abort_conns()
+                    raise
+        finally:
+            wq.put(None)
+            writer.join()
+            close_conns()
+
+        if errors:
+            raise errors[0]
+
+    sort_srt(out_srt, blocks)
 
 
 if __name__ == "__main__":